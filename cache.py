@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+
+class RawCache:
+    """
+    DolphinDB 原始查询结果的本地文件缓存
+    以 (db_path, db_table, symbol, start_date, end_date) 为键，把原始数据保存为 Parquet 文件，
+    重复运行时命中缓存即可跳过数据库查询
+    """
+
+    def __init__(self, cache_dir: str = ".cache", ttl: float = 7 * 86400):
+        """
+        初始化缓存
+
+        Parameters
+        ----------
+        cache_dir : str
+            缓存根目录，文件保存为 <cache_dir>/<original_symbol>/<md5(db_path|db_table|symbol|start|end)>.parquet
+        ttl : float
+            默认有效期（秒），超过有效期的缓存视为未命中
+        """
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+
+    def _paths(self, symbol: str, start_date: str, end_date: str, original_symbol: Optional[str], db_path: str, db_table: str):
+        """返回 (数据文件, 元信息文件) 路径；库表也计入键，切换查询的表后不会读到旧表的缓存"""
+        key = hashlib.md5(f"{db_path}|{db_table}|{symbol}|{start_date}|{end_date}".encode("utf-8")).hexdigest()
+        symbol_dir = self.cache_dir / (original_symbol or symbol)
+        return symbol_dir / f"{key}.parquet", symbol_dir / f"{key}.meta.json"
+
+    def get(self, symbol: str, start_date: str, end_date: str, ttl: Optional[float] = None,
+            original_symbol: Optional[str] = None, db_path: str = "", db_table: str = "") -> Optional[pd.DataFrame]:
+        """
+        读取缓存
+
+        Parameters
+        ----------
+        symbol : str
+            股票代码 (如 000001.SZ)
+        start_date, end_date : str
+            数据时间范围
+        ttl : float, optional
+            有效期（秒），默认使用初始化时的 ttl
+        original_symbol : str, optional
+            原始股票代码 (如 SZ000001)，用作缓存子目录名，默认使用 symbol
+        db_path, db_table : str
+            查询的数据库路径和表名
+
+        Returns
+        -------
+        pd.DataFrame or None
+            命中时返回原始数据；不存在、已过期或读取出错时返回 None
+        """
+        data_file, meta_file = self._paths(symbol, start_date, end_date, original_symbol, db_path, db_table)
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            with open(meta_file, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if time.time() - meta["ts"] > ttl:
+                return None
+            return pd.read_parquet(data_file)
+        except Exception:
+            return None
+
+    def put(self, symbol: str, start_date: str, end_date: str, df: pd.DataFrame,
+            original_symbol: Optional[str] = None, db_path: str = "", db_table: str = "") -> bool:
+        """
+        写入缓存（先写临时文件再替换，多线程写同一键时不会读到半个文件），参数含义同 get
+
+        Returns
+        -------
+        bool
+            是否写入成功；缓存只是加速手段，写入失败不抛出异常
+        """
+        data_file, meta_file = self._paths(symbol, start_date, end_date, original_symbol, db_path, db_table)
+        try:
+            data_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = data_file.with_name(f"{data_file.name}.{os.getpid()}_{threading.get_ident()}.tmp")
+            df.to_parquet(tmp_file, index=False)
+            os.replace(tmp_file, data_file)
+            with open(meta_file, "w", encoding="utf-8") as f:
+                json.dump({"db_path": db_path, "db_table": db_table, "symbol": symbol,
+                           "start_date": start_date, "end_date": end_date, "ts": time.time()}, f)
+            return True
+        except Exception:
+            return False
@@ -1,7 +1,10 @@
+import json
 import logging
 import os
+import queue
 import sys
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 from typing import List, Optional
 
@@ -32,25 +35,31 @@ class DataCollectorLogger:
         # 设置日志文件路径
         self.main_log_file = self.log_dir / f"data_collector_{timestamp}.log"
         self.error_log_file = self.log_dir / f"errors_{timestamp}.log"
-        self.failed_codes_file = self.log_dir / f"failed_codes_{timestamp}.txt"
+        self.failed_codes_file = self.log_dir / f"failed_codes_{timestamp}.jsonl"
         
-        # 存储失败的股票代码
-        self.failed_codes = []
+        # 失败的股票代码逐条追加写入文件，内存中只保留计数；文件在第一次失败时才打开
+        self._failed_codes_fh = None
+        self._failed_count = 0
         
-        # 设置主日志记录器
-        self.logger = self._setup_logger("DataCollector", self.main_log_file, log_level)
+        # 后台写日志的监听线程，close() 时停止
+        self._listener: Optional[QueueListener] = None
+        # 挂在记录器上的 QueueHandler，close() 时摘除
+        self._queue_handler: Optional[QueueHandler] = None
         
-        # 设置错误日志记录器
-        self.error_logger = self._setup_logger("ErrorLogger", self.error_log_file, "ERROR")
+        # 设置日志记录器（ERROR 及以上同时写入错误日志文件）
+        self.logger = self._setup_logger("DataCollector", self.main_log_file, log_level, self.error_log_file)
         
         self.logger.info(f"Logger initialized. Log files: {self.main_log_file}")
         self.logger.info(f"Error log: {self.error_log_file}")
         self.logger.info(f"Failed codes will be saved to: {self.failed_codes_file}")
     
-    def _setup_logger(self, name: str, log_file: Path, level: str) -> logging.Logger:
+    def _setup_logger(self, name: str, log_file: Path, level: str, error_log_file: Optional[Path] = None) -> logging.Logger:
         """
         设置日志记录器
         
+        记录器本身只挂一个 QueueHandler，调用方线程只做入队；
+        实际的文件/控制台写入由后台 QueueListener 线程完成。
+        
         Parameters
         ----------
         name : str
@@ -59,6 +68,8 @@ class DataCollectorLogger:
             日志文件路径
         level : str
             日志级别
+        error_log_file : Path, optional
+            错误日志文件路径，只接收 ERROR 及以上级别的记录
             
         Returns
         -------
@@ -87,9 +98,21 @@ class DataCollectorLogger:
         
         file_handler.setFormatter(formatter)
         console_handler.setFormatter(formatter)
+        handlers = [file_handler, console_handler]
+        
+        # 错误日志处理器
+        if error_log_file is not None:
+            error_handler = logging.FileHandler(error_log_file, encoding='utf-8')
+            error_handler.setLevel(logging.ERROR)
+            error_handler.setFormatter(formatter)
+            handlers.append(error_handler)
+        
+        log_queue = queue.Queue(-1)
+        self._queue_handler = QueueHandler(log_queue)
+        logger.addHandler(self._queue_handler)
         
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
+        self._listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        self._listener.start()
         
         return logger
     
@@ -104,19 +127,20 @@ class DataCollectorLogger:
     def error(self, message: str, exception: Optional[Exception] = None):
         """记录错误级别日志"""
         self.logger.error(message)
-        self.error_logger.error(message)
         if exception:
             self.logger.error(f"Exception details: {str(exception)}")
-            self.error_logger.error(f"Exception details: {str(exception)}")
     
     def debug(self, message: str):
         """记录调试级别日志"""
         self.logger.debug(message)
     
+    def isEnabledFor(self, level: int) -> bool:
+        """是否会输出 level 级别的日志，用于在格式化开销较大的日志消息前判断"""
+        return self.logger.isEnabledFor(level)
+    
     def critical(self, message: str):
         """记录严重错误日志"""
         self.logger.critical(message)
-        self.error_logger.critical(message)
     
     def log_stock_start(self, symbol: str, original_symbol: str, index: int, total: int):
         """记录开始处理股票"""
@@ -133,13 +157,20 @@ class DataCollectorLogger:
         message = f"❌ {symbol} ({original_symbol}) 处理失败: {error_msg}"
         self.error(message, exception)
         
-        # 添加到失败列表
-        self.failed_codes.append({
+        # 立即追加到失败代码文件（行缓冲，每条记录写入即落盘，程序崩溃也不会丢失已记录的失败代码）
+        record = {
             'symbol': symbol,
             'original_symbol': original_symbol,
             'error': error_msg,
             'timestamp': datetime.now().isoformat()
-        })
+        }
+        try:
+            if self._failed_codes_fh is None:
+                self._failed_codes_fh = open(self.failed_codes_file, 'a', encoding='utf-8', buffering=1)
+            self._failed_codes_fh.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._failed_count += 1
+        except Exception as e:
+            self.error(f"写入失败代码文件时出错: {str(e)}", e)
     
     def log_data_statistics(self, df, stage: str):
         """记录数据统计信息"""
@@ -147,19 +178,21 @@ class DataCollectorLogger:
             self.warning(f"{stage}: 数据为空")
             return
         
-        nan_stats = df.isnull().sum()
         total_records = len(df)
         
         self.info(f"{stage} 数据统计:")
         self.info(f"  总记录数: {total_records}")
         self.info(f"  数据列: {list(df.columns)}")
         
-        if nan_stats.sum() > 0:
+        # 先按列判断是否存在 NaN，只有存在时才做逐列计数
+        nan_mask = df.isna()
+        has_nan = nan_mask.any()
+        if has_nan.any():
             self.warning(f"  NaN 统计:")
+            nan_stats = nan_mask.loc[:, has_nan].sum()
             for col, nan_count in nan_stats.items():
-                if nan_count > 0:
-                    percentage = (nan_count / total_records) * 100
-                    self.warning(f"    {col}: {nan_count} ({percentage:.2f}%)")
+                percentage = (nan_count / total_records) * 100
+                self.warning(f"    {col}: {nan_count} ({percentage:.2f}%)")
         else:
             self.info("  ✅ 无 NaN 值")
     
@@ -186,40 +219,46 @@ class DataCollectorLogger:
         self.info("=" * 60)
     
     def save_failed_codes(self):
-        """保存失败的股票代码到文件"""
-        if not self.failed_codes:
+        """将已追加的失败代码刷新到文件（JSON Lines，每行一条记录，可用 pd.read_json(lines=True) 读取）"""
+        if self._failed_codes_fh is None:
             return
         
         try:
-            with open(self.failed_codes_file, 'w', encoding='utf-8') as f:
-                f.write(f"# 失败的股票代码记录 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                f.write(f"# 格式: 原始代码 -> 标准代码 | 错误信息 | 时间戳\n\n")
-                
-                for failed_code in self.failed_codes:
-                    f.write(f"{failed_code['original_symbol']} -> {failed_code['symbol']} | "
-                           f"{failed_code['error']} | {failed_code['timestamp']}\n")
-            
-            self.info(f"失败代码已保存到: {self.failed_codes_file}")
+            self._failed_codes_fh.flush()
+            self.info(f"失败代码已保存到: {self.failed_codes_file} ({self._failed_count} 条)")
             
         except Exception as e:
             self.error(f"保存失败代码文件时出错: {str(e)}", e)
     
     def get_failed_codes(self) -> List[dict]:
-        """获取失败的股票代码列表"""
-        return self.failed_codes.copy()
+        """获取失败的股票代码列表（从失败代码文件中读回）"""
+        if self._failed_codes_fh is None:
+            return []
+        
+        self._failed_codes_fh.flush()
+        with open(self.failed_codes_file, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
     
     def close(self):
         """关闭日志系统，保存失败代码"""
-        if self.failed_codes:
+        if self._failed_codes_fh is not None:
             self.save_failed_codes()
-        
-        # 关闭所有处理器
-        for handler in self.logger.handlers:
-            handler.close()
-        for handler in self.error_logger.handlers:
-            handler.close()
+            self._failed_codes_fh.close()
+            self._failed_codes_fh = None
         
         self.info("日志系统已关闭")
+        
+        # 先从记录器上摘除 QueueHandler：之后写入 "DataCollector" 的记录不再进入无人读取的队列
+        if self._queue_handler is not None:
+            self.logger.removeHandler(self._queue_handler)
+            self._queue_handler = None
+        
+        # 停止监听线程（会先写完队列中剩余的记录），再关闭所有处理器
+        if self._listener is not None:
+            self._listener.stop()
+            for handler in self._listener.handlers:
+                handler.close()
+            self._listener = None
 
 
 # 全局日志实例
@@ -1,53 +1,106 @@
-from dotenv import load_dotenv
+from dotenv import dotenv_values
 from dolphindb import session
 import os
-import csv
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass
+import numpy as np
 import pandas as pd
-from typing import List, Dict
+import pyarrow as pa
+import pyarrow.csv as pacsv
+from typing import List, Dict, Optional, Tuple
 from normalize import WindNormalize1d
 from logger import get_logger, close_logger
+from cache import RawCache
 
 
-def read_codes(file_path: str, n: int = 10) -> List[Dict[str, str]]:
-    """读取以制表符分隔的代码表，返回前 n 条记录。
+# 代码表中的表头取值
+_HEADER_SYMBOLS = frozenset(("symbol", "代码", "ticker"))
+# 需要重构为 <代码>.<交易所> 形式的交易所前缀
+_EXCHANGE_PREFIXES = frozenset(("SZ", "SH"))
 
-    每行预期至少有3列：symbol, start_date, end_date。忽略空行和列数不足的行。
-    返回的每条记录为 dict: {"symbol":..., "start_date":..., "end_date":...}
-    """
-    results: List[Dict[str, str]] = []
+
+def _format_symbols(symbols: pd.Series) -> pd.Series:
+    """向量化重构 symbol: e.g. 'SZ000001' -> '000001.SZ'，已含 '.' 或前缀不是 SZ/SH 的保持不变"""
+    prefix = symbols.str.slice(0, 2).str.upper()
+    convert = ~symbols.str.contains(".", regex=False) & prefix.isin(_EXCHANGE_PREFIXES) & (symbols.str.len() > 2)
+    return pd.Series(np.where(convert, symbols.str.slice(2) + "." + prefix, symbols), index=symbols.index)
+
+
+def _filter_codes(df: pd.DataFrame, require_dates: bool) -> pd.DataFrame:
+    """去除首尾空白，跳过表头、空代码以及（require_dates 时）日期为空的行"""
+    df = df.apply(lambda col: col.str.strip())
+    keep = (df['original_symbol'] != "") & ~df['original_symbol'].str.lower().isin(_HEADER_SYMBOLS)
+    if require_dates:
+        keep &= (df['start_date'] != "") & (df['end_date'] != "")
+    return df[keep]
+
+
+def _read_codes_frame(file_path: str, n: Optional[int] = None, dedupe: bool = False, fixed_dates: Optional[Tuple[str, str]] = None) -> pd.DataFrame:
+    """用 pandas C 引擎读取代码表，返回列为 symbol, start_date, end_date, original_symbol 的 DataFrame"""
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"文件不存在: {file_path}")
 
-    with open(file_path, "r", encoding="utf-8") as f:
-        reader = csv.reader(f, delimiter='\t')
-        for row in reader:
-            # 跳过空行或注释行
-            if not row:
-                continue
-            # 有些行可能包含额外的空白或注释，至少需要3列
-            if len(row) < 3:
-                continue
-            symbol = row[0].strip()
-            start_date = row[1].strip()
-            end_date = row[2].strip()
-            # 跳过表头（如果存在）
-            if symbol.lower() in ("symbol", "代码", "ticker"):
+    # 指定 fixed_dates 时只需要第1列
+    names = ['original_symbol'] if fixed_dates else ['original_symbol', 'start_date', 'end_date']
+    # 只需要前 n 条时先读取前 nrows 行，有效记录不足时再读取整个文件
+    nrows = None if n is None else max(2 * n, 1024)
+    while True:
+        try:
+            raw = pd.read_csv(file_path, sep='\t', header=None, names=names, usecols=list(range(len(names))),
+                              dtype=str, keep_default_na=False, engine='c', nrows=nrows)
+        except ValueError as e:
+            # 文件中没有任何一行达到所需列数
+            if "Too many columns specified" not in str(e):
+                raise
+            if nrows is not None:
+                nrows = None
                 continue
-            # 重构 symbol: e.g. 'SZ000001' -> '000001.SZ', 'SH600000' -> '600000.SH'
-            if "." in symbol:
-                symbol_fmt = symbol
-            else:
-                prefix = symbol[:2].upper() if len(symbol) >= 2 else ""
-                rest = symbol[2:] if len(symbol) > 2 else symbol
-                if prefix in ("SZ", "SH") and rest:
-                    symbol_fmt = f"{rest}.{prefix}"
-                else:
-                    symbol_fmt = symbol
+            raw = pd.DataFrame(columns=names, dtype=str)
+        df = _filter_codes(raw, not fixed_dates)
+        if dedupe:
+            df = df.drop_duplicates('original_symbol')
+        if nrows is None or len(df) >= n or len(raw) < nrows:
+            break
+        nrows = None
+
+    if n is not None:
+        df = df.head(n)
+    if fixed_dates:
+        df = df.assign(start_date=fixed_dates[0], end_date=fixed_dates[1])
+    df = df.assign(symbol=_format_symbols(df['original_symbol']).astype(str))
+    return df[['symbol', 'start_date', 'end_date', 'original_symbol']].reset_index(drop=True)
 
-            results.append({"symbol": symbol_fmt, "start_date": start_date, "end_date": end_date, "original_symbol": symbol})
-            if len(results) >= n:
-                break
-    return results
+
+def load_codes(file_path: str, n: Optional[int] = None, dedupe: bool = False, fixed_dates: Optional[Tuple[str, str]] = None) -> List[Dict[str, str]]:
+    """读取以制表符分隔的代码表。
+
+    每行格式为 symbol, start_date, end_date。忽略空行、表头、代码为空和列数不足的行：
+    未指定 fixed_dates 时至少需要3列且日期非空，指定时只需要第1列（日期统一取 fixed_dates）。
+
+    Args:
+        file_path: 代码表路径
+        n: 最多返回的记录数，None 表示全部
+        dedupe: 是否按原始代码去重（保留首次出现的记录）
+        fixed_dates: (start_date, end_date)，指定时覆盖文件中的日期
+
+    Returns:
+        List[Dict[str, str]]: 每条记录为 {"symbol", "start_date", "end_date", "original_symbol"}，
+        其中 symbol 已重构，如 'SZ000001' -> '000001.SZ'
+    """
+    df = _read_codes_frame(file_path, n=n, dedupe=dedupe, fixed_dates=fixed_dates)
+    return [
+        {"symbol": s, "start_date": a, "end_date": b, "original_symbol": o}
+        for s, a, b, o in zip(df['symbol'].tolist(), df['start_date'].tolist(),
+                              df['end_date'].tolist(), df['original_symbol'].tolist())
+    ]
+
+
+def read_codes(file_path: str, n: int = 10) -> List[Dict[str, str]]:
+    """读取以制表符分隔的代码表，返回前 n 条记录（日期取自文件）。"""
+    return load_codes(file_path, n=n)
 
 
 def get_unique_csi300_codes(file_path: str) -> List[Dict[str, str]]:
@@ -56,64 +109,329 @@ def get_unique_csi300_codes(file_path: str) -> List[Dict[str, str]]:
     Returns:
         List[Dict[str, str]]: 去重后的股票代码列表，每个包含symbol, start_date, end_date, original_symbol
     """
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"文件不存在: {file_path}")
-    
-    # 使用set来去重股票代码
-    unique_symbols = set()
-    results = []
-    
     # 固定的时间范围
     fixed_start_date = "2008-01-01"
     fixed_end_date = "2025-08-01"
     
-    with open(file_path, "r", encoding="utf-8") as f:
-        reader = csv.reader(f, delimiter='\t')
-        for row in reader:
-            # 跳过空行或注释行
-            if not row:
-                continue
-            # 有些行可能包含额外的空白或注释，至少需要1列（股票代码）
-            if len(row) < 1:
-                continue
-            
-            symbol = row[0].strip()
-            
-            # 跳过表头（如果存在）
-            if symbol.lower() in ("symbol", "代码", "ticker"):
-                continue
+    results = load_codes(file_path, dedupe=True, fixed_dates=(fixed_start_date, fixed_end_date))
+    print(f"原始数据共有记录数，去重后获得 {len(results)} 个唯一股票代码")
+    return results
+
+
+@dataclass
+class Config:
+    """运行配置，取自 .env 文件和环境变量（环境变量优先，与 load_dotenv 的默认行为一致）"""
+    host: str = "localhost"
+    port: int = 8848
+    user: str = "admin"
+    password: str = "123456"
+    workers: int = 8
+    batch_size: int = 50
+
+    def __post_init__(self):
+        # 会话池为空时流水线会一直等待，批大小为 0 时无法分批，启动时直接报错
+        if self.workers < 1:
+            raise ValueError(f"FETCH_WORKERS 必须 >= 1，当前为 {self.workers}")
+        if self.batch_size < 1:
+            raise ValueError(f"FETCH_BATCH_SIZE 必须 >= 1，当前为 {self.batch_size}")
+
+    @classmethod
+    def from_env(cls, env_file: str = ".env") -> "Config":
+        env = {**dotenv_values(env_file), **os.environ}
+        return cls(
+            host=env.get("DOLPHINDB_HOST") or cls.host,
+            port=int(env.get("DOLPHINDB_PORT") or cls.port),
+            user=env.get("DOLPHINDB_USERNAME") or cls.user,
+            password=env.get("DOLPHINDB_PASSWORD") or cls.password,
+            workers=int(env.get("FETCH_WORKERS") or cls.workers),
+            batch_size=int(env.get("FETCH_BATCH_SIZE") or cls.batch_size),
+        )
+
+
+# AShareEODPrices 查询函数：由 SessionPool.bind_table 在每个会话中定义一次，之后每次查询
+# 只需 s.run(FETCH_FUNC, sym, sd, ed) 一次往返；股票代码和日期作为函数参数传入，不拼接进脚本
+FETCH_FUNC = "fetchBars"
+FETCH_BULK_FUNC = "fetchBarsBulk"
+_FETCH_FUNC_DEFS = """
+def fetchBars(sym, sd, ed) {{
+    return SELECT S_INFO_WINDCODE, TRADE_DT, S_DQ_OPEN, S_DQ_HIGH, S_DQ_LOW, S_DQ_CLOSE,
+                  S_DQ_VOLUME, S_DQ_AMOUNT, S_DQ_ADJCLOSE
+           FROM loadTable("{db_path}", "{db_table}")
+           WHERE S_INFO_WINDCODE = sym AND TRADE_DT >= sd AND TRADE_DT <= ed
+           ORDER BY TRADE_DT
+}}
+def fetchBarsBulk(syms, sd, ed) {{
+    return SELECT S_INFO_WINDCODE, TRADE_DT, S_DQ_OPEN, S_DQ_HIGH, S_DQ_LOW, S_DQ_CLOSE,
+                  S_DQ_VOLUME, S_DQ_AMOUNT, S_DQ_ADJCLOSE
+           FROM loadTable("{db_path}", "{db_table}")
+           WHERE S_INFO_WINDCODE in syms AND TRADE_DT >= sd AND TRADE_DT <= ed
+           ORDER BY TRADE_DT
+}}
+"""
+
+
+# 标准化数据的输出列及类型：qlib dump_bin 以 float32 保存特征，输出时即转为 float32，
+# 不损失下游精度，同时减少约一半的 CSV 编码量和文件大小
+OUTPUT_COLS = ['date', 'open', 'high', 'low', 'close', 'volume', 'amount', 'adjclose', 'change', 'factor']
+OUTPUT_DTYPES = {col: 'float32' for col in OUTPUT_COLS if col != 'date'}
+
+# DolphinDB API 网络异常信息中的关键字
+_CONNECTION_ERROR_KEYWORDS = ("connection", "socket")
+
+
+class SessionPool:
+    """DolphinDB 会话池：预先建立 size 个已连接的 session，供多个线程轮流借用，避免每支股票都重新连接"""
+
+    def __init__(self, size: int, host: str, port: int, user: str, password: str):
+        self._host = host
+        self._port = port
+        self._user = user
+        self._password = password
+        # 后进先出：优先借出最近使用过的会话
+        self._q: "queue.LifoQueue[session]" = queue.LifoQueue()
+        # 每个会话中查询函数当前绑定的 (db_path, db_table)
+        self._bound: Dict[int, Tuple[str, str]] = {}
+        try:
+            for _ in range(size):
+                self._q.put(self._connect_new())
+        except Exception:
+            # 中途连接失败时关闭已建立的会话再抛出，避免泄漏连接
+            self.close_all()
+            raise
+
+    def _connect_new(self) -> session:
+        s = session()
+        s.connect(self._host, self._port, self._user, self._password)
+        return s
+
+    def acquire(self) -> session:
+        """借出一个会话，池空时阻塞等待"""
+        return self._q.get()
+
+    def release(self, s: session, healthy: bool = True):
+        """归还会话；healthy=False 时关闭该会话并换成新建立的连接，避免把坏连接放回池中"""
+        if not healthy:
+            self._bound.pop(id(s), None)
+            try:
+                s.close()
+            except Exception:
+                pass
+            try:
+                s = self._connect_new()
+            except Exception:
+                # 重连失败（如数据库正在重启）时仍归还旧会话：下次借出后会再次失败并重试重连，池大小保持不变
+                pass
+        self._q.put(s)
+
+    @staticmethod
+    def is_broken(s: session, e: Exception) -> bool:
+        """判断出现异常 e 后会话 s 是否已不可用（网络异常或连接已断开）；SQL 错误等不影响会话本身"""
+        if isinstance(e, OSError):
+            return True
+        # DolphinDB API 的异常均为 RuntimeError，只能通过连接状态和错误信息区分
+        message = str(e).lower()
+        if any(keyword in message for keyword in _CONNECTION_ERROR_KEYWORDS):
+            return True
+        try:
+            return s.isClosed()
+        except Exception:
+            return True
+
+    def bind_table(self, s: session, db_path: str, db_table: str):
+        """在会话中定义查询 db_path/db_table 的 FETCH_FUNC / FETCH_BULK_FUNC，同一会话同一张表只定义一次"""
+        key = (db_path, db_table)
+        if self._bound.get(id(s)) != key:
+            s.run(_FETCH_FUNC_DEFS.format(db_path=db_path, db_table=db_table))
+            self._bound[id(s)] = key
+
+    def close_all(self):
+        """关闭池中所有会话"""
+        while True:
+            try:
+                s = self._q.get_nowait()
+            except queue.Empty:
+                break
+            self._bound.pop(id(s), None)
+            try:
+                s.close()
+            except Exception:
+                pass
+
+
+def _output_path(data_dir, original_symbol, normalize_data=True):
+    """输出文件路径：标准化数据为 <原始代码>.csv，原始数据为 <原始代码>_raw.csv"""
+    filename = f"{original_symbol}.csv" if normalize_data else f"{original_symbol}_raw.csv"
+    return os.path.join(data_dir, filename)
+
+
+def _load_existing(filepath, logger=None, end_date=None, freshness_days=None):
+    """输出文件已存在、非空且仍然有效时读取并返回，否则返回 None
+    
+    freshness_days 不为 None 时检查文件修改时间：写入时 end_date 已过去的文件数据完整，始终有效；
+    否则文件可能缺少之后的交易日，超过 freshness_days 天即视为过期，需要重新获取。
+    """
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return None
+    if st.st_size == 0:
+        return None
+    if freshness_days is not None:
+        try:
+            complete = st.st_mtime >= time.mktime(time.strptime(end_date, "%Y-%m-%d")) + 86400
+        except (TypeError, ValueError):
+            # end_date 缺失或不是 YYYY-MM-DD 格式时无法判断，按数据可能不完整处理
+            complete = False
+        if not complete and time.time() - st.st_mtime >= freshness_days * 86400:
+            if logger:
+                logger.info(f"输出文件已过期，重新获取: {filepath}")
+            else:
+                print(f"输出文件已过期，重新获取: {filepath}")
+            return None
+    try:
+        existing = pd.read_csv(filepath)
+    except Exception as e:
+        # 文件损坏或无法解析时视为不存在，重新获取
+        if logger:
+            logger.warning(f"输出文件读取失败，重新获取: {filepath} ({e})")
+        else:
+            print(f"输出文件读取失败，重新获取: {filepath} ({e})")
+        return None
+    if logger:
+        logger.info(f"输出文件已存在，跳过查询: {filepath}")
+    else:
+        print(f"输出文件已存在，跳过查询: {filepath}")
+    return existing
+
+
+def _query_params(start_date, end_date):
+    """把 YYYY-MM-DD 日期转换为查询函数的 (sd, ed) DATE 参数"""
+    return np.datetime64(start_date, 'D'), np.datetime64(end_date, 'D')
+
+
+def _write_csv(df, filepath):
+    """用 pyarrow 的 C++ CSV 写入器保存 DataFrame（不写索引）"""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for i, field in enumerate(table.schema):
+        if pa.types.is_timestamp(field.type):
+            # 日线数据的时间都是零点，写成 YYYY-MM-DD，与 to_csv 的输出保持一致
+            try:
+                table = table.set_column(i, field.name, table.column(i).cast(pa.date32()))
+            except pa.ArrowInvalid:
+                pass
+        elif pa.types.is_dictionary(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(field.type.value_type))
+    write_options = pacsv.WriteOptions(include_header=True)
+    # 先写同目录下的临时文件再替换：中途被终止时不会留下半个 CSV 被续跑误当作已完成
+    tmp_file = f"{filepath}.{os.getpid()}_{threading.get_ident()}.tmp"
+    try:
+        try:
+            pacsv.write_csv(table, tmp_file, write_options=write_options)
+        except FileNotFoundError:
+            # 输出目录通常已在启动时创建，仅在目录缺失时（如单独调用 API）补建
+            os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+            pacsv.write_csv(table, tmp_file, write_options=write_options)
+        os.replace(tmp_file, filepath)
+    except BaseException:
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+        raise
+
+
+def _default_normalizer(logger=None):
+    """使用 calendar/day.txt 交易日历创建标准化处理器"""
+    calendar_file = os.path.join(os.path.dirname(__file__), "calendar", "day.txt")
+    return WindNormalize1d(calendar_file_path=calendar_file, logger=logger)
+
+
+def _to_output_frame(df):
+    """按 OUTPUT_COLS 选取标准化数据的输出列（缺少的列跳过），数值列转为 float32"""
+    cols = [col for col in OUTPUT_COLS if col in df.columns]
+    return df[cols].astype({col: OUTPUT_DTYPES[col] for col in cols if col in OUTPUT_DTYPES})
+
+
+def _normalize(raw_data, normalize_data=True, logger=None, normalizer=None):
+    """对单支股票的原始数据进行标准化（可选），返回需要保存的数据；标准化失败或结果为空时返回原始数据"""
+    if logger:
+        logger.info(f"从DolphinDB获取到 {len(raw_data)} 条原始记录")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"原始数据列: {list(raw_data.columns)}")
+        logger.log_data_statistics(raw_data, "原始数据")
+    else:
+        print(f"从DolphinDB获取到 {len(raw_data)} 条原始记录")
+    
+    # 数据标准化处理
+    if normalize_data:
+        if logger:
+            logger.info("开始Wind数据标准化...")
+        else:
+            print("开始Wind数据标准化...")
+        # 未传入处理器时临时创建（会重新读取交易日历）
+        if normalizer is None:
+            normalizer = _default_normalizer(logger)
+        
+        try:
+            # 使用WindNormalize1d进行标准化
+            normalized_data = normalizer.normalize(raw_data)
             
-            # 如果这个股票代码还没有添加过，则添加
-            if symbol not in unique_symbols:
-                unique_symbols.add(symbol)
+            if not normalized_data.empty:
+                if logger:
+                    logger.info(f"标准化后数据: {len(normalized_data)} 条记录")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"标准化后列: {list(normalized_data.columns)}")
+                    logger.log_data_statistics(normalized_data, "标准化后数据")
+                else:
+                    print(f"标准化后数据: {len(normalized_data)} 条记录")
                 
-                # 重构 symbol: e.g. 'SZ000001' -> '000001.SZ', 'SH600000' -> '600000.SH'
-                if "." in symbol:
-                    symbol_fmt = symbol
+                data_to_save = _to_output_frame(normalized_data)
+            else:
+                if logger:
+                    logger.warning("标准化后数据为空，保存原始数据")
                 else:
-                    prefix = symbol[:2].upper() if len(symbol) >= 2 else ""
-                    rest = symbol[2:] if len(symbol) > 2 else symbol
-                    if prefix in ("SZ", "SH") and rest:
-                        symbol_fmt = f"{rest}.{prefix}"
-                    else:
-                        symbol_fmt = symbol
+                    print("警告: 标准化后数据为空，保存原始数据")
+                data_to_save = raw_data
                 
-                results.append({
-                    "symbol": symbol_fmt, 
-                    "start_date": fixed_start_date, 
-                    "end_date": fixed_end_date, 
-                    "original_symbol": symbol
-                })
+        except Exception as norm_error:
+            if logger:
+                logger.error(f"数据标准化出错: {norm_error}", norm_error)
+                logger.info("保存原始数据")
+            else:
+                print(f"数据标准化出错: {norm_error}")
+                print("保存原始数据")
+            data_to_save = raw_data
+    else:
+        if logger:
+            logger.info("跳过数据标准化，保存原始数据")
+        else:
+            print("跳过数据标准化，保存原始数据")
+        data_to_save = raw_data
     
-    print(f"原始数据共有记录数，去重后获得 {len(results)} 个唯一股票代码")
-    return results
+    return data_to_save
+
+
+def _save(data, filepath, logger=None):
+    """保存数据文件"""
+    _write_csv(data, filepath)
+    if logger:
+        logger.info(f"数据已保存到: {filepath}")
+    else:
+        print(f"数据已保存到: {filepath}")
+
+
+def _normalize_and_save(raw_data, filepath, normalize_data=True, logger=None, normalizer=None):
+    """对单支股票的原始数据进行标准化（可选）并保存到 filepath，返回保存的数据"""
+    data_to_save = _normalize(raw_data, normalize_data, logger, normalizer)
+    _save(data_to_save, filepath, logger)
+    return data_to_save
 
 
-def fetch_and_save_data(host, port, user, password, db_path, db_table, symbol, start_date, end_date, original_symbol, data_dir="data", normalize_data=True, logger=None):
+def fetch_and_save_data(pool, db_path, db_table, symbol, start_date, end_date, original_symbol, data_dir="data", normalize_data=True, logger=None, overwrite=False, cache=None, normalizer=None, freshness_days=1):
     """从 DolphinDB 获取指定股票的 AShareEODPrices 数据，进行标准化并保存到文件
     
     Args:
-        host, port, user, password: DolphinDB 连接参数
+        pool: DolphinDB 会话池 (SessionPool)
         db_path, db_table: 数据库路径和表名 (AShareEODPrices)
         symbol: 重构后的股票代码 (如 000001.SZ)
         start_date, end_date: 数据时间范围 (格式: YYYY-MM-DD)
@@ -121,8 +439,11 @@ def fetch_and_save_data(host, port, user, password, db_path, db_table, symbol, s
         data_dir: 保存数据的目录
         normalize_data: 是否对数据进行标准化处理
         logger: 日志记录器
-        data_dir: 保存数据的目录
-        normalize_data: 是否对数据进行标准化处理
+        overwrite: 为 False 时若输出文件已存在且非空则直接读取返回，不再查询数据库
+        freshness_days: 输出文件的有效期（天），仅对写入时 end_date 尚未过去的文件生效；为 None 时永不过期
+        cache: 原始数据缓存 (RawCache)，命中时跳过数据库查询，查询成功后写入缓存
+        normalizer: 标准化处理器 (WindNormalize1d)，批量处理时应复用同一实例以免重复读取交易日历；
+            为 None 时按 calendar/day.txt 临时创建
         
     AShareEODPrices 表字段:
         S_INFO_WINDCODE (Wind代码), TRADE_DT (交易日期),
@@ -133,106 +454,42 @@ def fetch_and_save_data(host, port, user, password, db_path, db_table, symbol, s
         S_DQ_ADJLOW (复权最低价), S_DQ_ADJCLOSE (复权收盘价), S_DQ_ADJFACTOR (复权因子),
         S_DQ_AVGPRICE (均价VWAP)
     """
-    s = session()
+    # 输出文件已存在时跳过查询（支持中断后续跑）
+    filepath = _output_path(data_dir, original_symbol, normalize_data)
+    if not overwrite:
+        existing = _load_existing(filepath, logger, end_date, freshness_days)
+        if existing is not None:
+            return existing
+
     try:
-        s.connect(host, port, user, password)
-        
-        # 将日期格式从 YYYY-MM-DD 转换为 DolphinDB DATE 格式
-        # DolphinDB 中日期需要使用 date() 函数或特定格式
-        start_date_fmt = start_date.replace('-', '.')
-        end_date_fmt = end_date.replace('-', '.')
-        
-        # 构造查询脚本 - 根据 AShareEODPrices 表结构
-        script = f'''
-        db = loadTable("{db_path}", "{db_table}")
-        SELECT S_INFO_WINDCODE, TRADE_DT, S_DQ_OPEN, S_DQ_HIGH, S_DQ_LOW, S_DQ_CLOSE,
-               S_DQ_VOLUME, S_DQ_AMOUNT, S_DQ_ADJCLOSE
-        FROM db
-        WHERE S_INFO_WINDCODE = "{symbol}"
-          AND TRADE_DT >= date({start_date_fmt})
-          AND TRADE_DT <= date({end_date_fmt})
-        ORDER BY TRADE_DT
-        '''
-        
-        if logger:
-            logger.debug(f"获取 {symbol} ({original_symbol}) 从 {start_date} 到 {end_date} 的数据")
-            logger.debug(f"查询脚本: {script}")
-        else:
-            print(f"正在获取 {symbol} ({original_symbol}) 从 {start_date} 到 {end_date} 的数据...")
-            print(f"查询脚本: {script}")
-        
-        raw_data = s.run(script)
-        
-        if raw_data is not None and len(raw_data) > 0:
+        cache_key = dict(original_symbol=original_symbol, db_path=db_path, db_table=db_table)
+        raw_data = cache.get(symbol, start_date, end_date, **cache_key) if cache is not None else None
+        if raw_data is not None:
             if logger:
-                logger.info(f"从DolphinDB获取到 {len(raw_data)} 条原始记录")
-                logger.debug(f"原始数据列: {list(raw_data.columns)}")
-                logger.log_data_statistics(raw_data, "原始数据")
-            else:
-                print(f"从DolphinDB获取到 {len(raw_data)} 条原始记录")
-                print(f"原始数据列: {list(raw_data.columns)}")
-            
-            # 数据标准化处理
-            if normalize_data:
-                if logger:
-                    logger.info("开始Wind数据标准化...")
-                else:
-                    print("开始Wind数据标准化...")
-                # 构建交易日历文件路径
-                calendar_file = os.path.join(os.path.dirname(__file__), "calendar", "day.txt")
-                normalizer = WindNormalize1d(calendar_file_path=calendar_file, logger=logger)
-                
-                try:
-                    # 使用WindNormalize1d进行标准化
-                    normalized_data = normalizer.normalize(raw_data)
-                    
-                    if not normalized_data.empty:
-                        if logger:
-                            logger.info(f"标准化后数据: {len(normalized_data)} 条记录")
-                            logger.debug(f"标准化后列: {list(normalized_data.columns)}")
-                            logger.log_data_statistics(normalized_data, "标准化后数据")
-                        else:
-                            print(f"标准化后数据: {len(normalized_data)} 条记录")
-                            print(f"标准化后列: {list(normalized_data.columns)}")
-                        
-                        data_to_save = normalized_data
-                    else:
-                        if logger:
-                            logger.warning("标准化后数据为空，保存原始数据")
-                        else:
-                            print("警告: 标准化后数据为空，保存原始数据")
-                        data_to_save = raw_data
-                        
-                except Exception as norm_error:
-                    if logger:
-                        logger.error(f"数据标准化出错: {norm_error}", norm_error)
-                        logger.info("保存原始数据")
-                    else:
-                        print(f"数据标准化出错: {norm_error}")
-                        print("保存原始数据")
-                    data_to_save = raw_data
-            else:
-                if logger:
-                    logger.info("跳过数据标准化，保存原始数据")
-                else:
-                    print("跳过数据标准化，保存原始数据")
-                data_to_save = raw_data
-            
-            # 确保 data 目录存在
-            os.makedirs(data_dir, exist_ok=True)
-            
-            # 保存数据文件
-            filename = f"{original_symbol}.csv" if normalize_data else f"{original_symbol}_raw.csv"
-            filepath = os.path.join(data_dir, filename)
-            
-            data_to_save.to_csv(filepath, index=False)
+                logger.debug(f"{symbol} ({original_symbol}) 命中原始数据缓存")
+        else:
             if logger:
-                logger.info(f"数据已保存到: {filepath}")
+                logger.debug(f"获取 {symbol} ({original_symbol}) 从 {start_date} 到 {end_date} 的数据")
+                logger.debug(f"查询函数: {FETCH_FUNC}")
             else:
-                print(f"数据已保存到: {filepath}")
+                print(f"正在获取 {symbol} ({original_symbol}) 从 {start_date} 到 {end_date} 的数据...")
             
-            return data_to_save
+            s = pool.acquire()
+            healthy = True
+            try:
+                pool.bind_table(s, db_path, db_table)
+                raw_data = s.run(FETCH_FUNC, symbol, *_query_params(start_date, end_date))
+            except Exception as e:
+                healthy = not pool.is_broken(s, e)
+                raise
+            finally:
+                pool.release(s, healthy)
             
+            if cache is not None and raw_data is not None and len(raw_data) > 0:
+                cache.put(symbol, start_date, end_date, raw_data, **cache_key)
+        
+        if raw_data is not None and len(raw_data) > 0:
+            return _normalize_and_save(raw_data, filepath, normalize_data, logger, normalizer)
         else:
             if logger:
                 logger.warning(f"未找到 {symbol} 的数据")
@@ -246,28 +503,263 @@ def fetch_and_save_data(host, port, user, password, db_path, db_table, symbol, s
         else:
             print(f"获取 {symbol} 数据时出错: {e}")
         return None
+
+
+def _fetch_bulk(pool, db_path, db_table, items, data_dir="data", normalize_data=True, logger=None, overwrite=False, cache=None, freshness_days=1) -> Tuple[Dict[str, pd.DataFrame], Dict[str, Optional[pd.DataFrame]]]:
+    """fetch_and_save_bulk 的获取阶段：读取已有输出，其余股票查缓存，未命中的用一条 IN 查询获取
+    
+    Returns:
+        (existing, raw): existing 为 original_symbol -> 已有输出文件的数据；
+        raw 为其余股票的 original_symbol -> 原始数据，未获取到数据或查询失败时为 None
+    """
+    existing: Dict[str, pd.DataFrame] = {}
+    raw: Dict[str, Optional[pd.DataFrame]] = {}
+    
+    # 已有输出的股票直接读取，其余按时间范围分组
+    pending: Dict[tuple, List[Dict[str, str]]] = {}
+    for item in items:
+        if not overwrite:
+            data = _load_existing(
+                _output_path(data_dir, item['original_symbol'], normalize_data), logger, item['end_date'], freshness_days
+            )
+            if data is not None:
+                existing[item['original_symbol']] = data
+                continue
+        pending.setdefault((item['start_date'], item['end_date']), []).append(item)
+    
+    for (start_date, end_date), group_items in pending.items():
+        by_symbol = {item['symbol']: item for item in group_items}
+        
+        # 先查缓存，只对未命中的股票发起查询
+        groups = {}
+        if cache is not None:
+            for symbol, item in by_symbol.items():
+                cached = cache.get(symbol, start_date, end_date, original_symbol=item['original_symbol'],
+                                   db_path=db_path, db_table=db_table)
+                if cached is not None:
+                    groups[symbol] = cached
+        missing = [symbol for symbol in by_symbol if symbol not in groups]
+        
+        if missing:
+            if logger:
+                logger.debug(f"批量获取 {len(missing)} 支股票从 {start_date} 到 {end_date} 的数据")
+                logger.debug(f"查询函数: {FETCH_BULK_FUNC}")
+            else:
+                print(f"正在批量获取 {len(missing)} 支股票从 {start_date} 到 {end_date} 的数据...")
+            
+            s = pool.acquire()
+            healthy = True
+            try:
+                pool.bind_table(s, db_path, db_table)
+                raw_data = s.run(FETCH_BULK_FUNC, missing, *_query_params(start_date, end_date))
+            except Exception as e:
+                healthy = not pool.is_broken(s, e)
+                if logger:
+                    logger.error(f"批量获取 {len(missing)} 支股票数据时出错: {e}", e)
+                else:
+                    print(f"批量获取 {len(missing)} 支股票数据时出错: {e}")
+                for symbol in missing:
+                    raw[by_symbol.pop(symbol)['original_symbol']] = None
+                raw_data = None
+            finally:
+                pool.release(s, healthy)
+            
+            if raw_data is not None and len(raw_data) > 0:
+                for symbol, symbol_data in raw_data.groupby('S_INFO_WINDCODE', sort=False, observed=True):
+                    symbol_data = symbol_data.reset_index(drop=True)
+                    groups[symbol] = symbol_data
+                    if cache is not None:
+                        cache.put(symbol, start_date, end_date, symbol_data,
+                                  original_symbol=by_symbol.get(symbol, {}).get('original_symbol'),
+                                  db_path=db_path, db_table=db_table)
+        
+        for symbol, item in by_symbol.items():
+            symbol_data = groups.get(symbol)
+            if symbol_data is None or symbol_data.empty:
+                if logger:
+                    logger.warning(f"未找到 {symbol} 的数据")
+                else:
+                    print(f"未找到 {symbol} 的数据")
+                symbol_data = None
+            raw[item['original_symbol']] = symbol_data
+    
+    return existing, raw
+
+
+def fetch_and_save_bulk(pool, db_path, db_table, items, data_dir="data", normalize_data=True, logger=None, overwrite=False, cache=None, normalizer=None, freshness_days=1) -> Dict[str, pd.DataFrame]:
+    """用一条 IN 查询获取一批股票的数据，按股票拆分后分别标准化并保存
+    
+    批内时间范围相同的股票合并为一次查询（get_unique_csi300_codes 的结果全部相同，即每批一次）。
+    
+    Args:
+        pool: DolphinDB 会话池 (SessionPool)
+        db_path, db_table: 数据库路径和表名 (AShareEODPrices)
+        items: get_unique_csi300_codes / read_codes 返回的记录列表
+        data_dir, normalize_data, logger, overwrite, cache, normalizer, freshness_days: 同 fetch_and_save_data，命中缓存的股票不参与查询
+        
+    Returns:
+        Dict[str, pd.DataFrame]: original_symbol -> 保存的数据，未获取到数据或处理失败时为 None
+    """
+    if normalize_data and normalizer is None:
+        normalizer = _default_normalizer(logger)
+    
+    results, raw = _fetch_bulk(pool, db_path, db_table, items, data_dir, normalize_data, logger, overwrite, cache, freshness_days)
+    for item in items:
+        original_symbol = item['original_symbol']
+        if original_symbol not in raw:
+            continue
+        symbol_data = raw.pop(original_symbol)
+        if symbol_data is None:
+            results[original_symbol] = None
+            continue
+        
+        filepath = _output_path(data_dir, original_symbol, normalize_data)
+        try:
+            results[original_symbol] = _normalize_and_save(
+                symbol_data, filepath, normalize_data, logger, normalizer
+            )
+        except Exception as e:
+            if logger:
+                logger.error(f"处理 {item['symbol']} 数据时出错: {e}", e)
+            else:
+                print(f"处理 {item['symbol']} 数据时出错: {e}")
+            results[original_symbol] = None
+    
+    return results
+
+
+def run_pipeline(pool, db_path, db_table, items, batch_size=50, fetch_workers=1, normalize_workers=None, write_workers=2, data_dir="data", normalize_data=True, logger=None, overwrite=False, cache=None, normalizer=None, freshness_days=1):
+    """按 获取 -> 标准化 -> 写入 三个阶段流水线处理全部股票，各阶段由独立的线程组并发执行
+    
+    获取（网络）、标准化（CPU）、写入（磁盘）占用不同的资源，流水线化后下一批的查询与
+    上一批的标准化、写入同时进行，总耗时趋近于最慢的阶段而不是三者之和。
+    
+    Args:
+        pool, db_path, db_table: 同 fetch_and_save_bulk
+        items: get_unique_csi300_codes / read_codes 返回的记录列表
+        batch_size: 每条 IN 查询包含的股票数
+        fetch_workers: 获取线程数，一般等于会话池大小
+        normalize_workers: 标准化线程数，默认 os.cpu_count()
+        write_workers: 写入线程数
+        data_dir, normalize_data, logger, overwrite, cache, normalizer, freshness_days: 同 fetch_and_save_data
+        
+    Yields:
+        (item, data): 按完成顺序逐支返回，data 为保存的数据，未获取到数据或处理失败时为 None
+    """
+    if normalize_data and normalizer is None:
+        normalizer = _default_normalizer(logger)
+    normalize_workers = normalize_workers or os.cpu_count() or 1
+    
+    # 阶段之间的队列，None 为结束标记；中间队列有界，避免获取过快时原始数据堆积在内存中
+    fetch_q: "queue.Queue[Optional[List[Dict[str, str]]]]" = queue.Queue()
+    norm_q: queue.Queue = queue.Queue(maxsize=batch_size * 2)
+    write_q: queue.Queue = queue.Queue(maxsize=batch_size * 2)
+    result_q: queue.Queue = queue.Queue()
+    # 调用方提前关闭生成器（如 Ctrl-C 或循环体抛出异常）时置位，各阶段跳过剩余任务
+    cancelled = threading.Event()
+    
+    def fetcher():
+        while (task := fetch_q.get()) is not None:
+            batch_start, batch = task
+            if cancelled.is_set():
+                continue
+            if logger:
+                for i, item in enumerate(batch, batch_start + 1):
+                    logger.log_stock_start(item['symbol'], item['original_symbol'], i, len(items))
+            try:
+                existing, raw = _fetch_bulk(pool, db_path, db_table, batch, data_dir, normalize_data, logger, overwrite, cache, freshness_days)
+            except Exception as e:
+                if logger:
+                    logger.error(f"批量获取 {len(batch)} 支股票数据时出错: {e}", e)
+                else:
+                    print(f"批量获取 {len(batch)} 支股票数据时出错: {e}")
+                existing, raw = {}, {}
+            for item in batch:
+                original_symbol = item['original_symbol']
+                if original_symbol in existing:
+                    result_q.put((item, existing.pop(original_symbol)))
+                elif raw.get(original_symbol) is not None:
+                    norm_q.put((item, raw.pop(original_symbol)))
+                else:
+                    result_q.put((item, None))
+    
+    def normalize_worker():
+        while (task := norm_q.get()) is not None:
+            if cancelled.is_set():
+                continue
+            item, raw_data = task
+            try:
+                write_q.put((item, _normalize(raw_data, normalize_data, logger, normalizer)))
+            except Exception as e:
+                if logger:
+                    logger.error(f"处理 {item['symbol']} 数据时出错: {e}", e)
+                else:
+                    print(f"处理 {item['symbol']} 数据时出错: {e}")
+                result_q.put((item, None))
+    
+    def writer():
+        while (task := write_q.get()) is not None:
+            if cancelled.is_set():
+                continue
+            item, data = task
+            try:
+                _save(data, _output_path(data_dir, item['original_symbol'], normalize_data), logger)
+            except Exception as e:
+                if logger:
+                    logger.error(f"保存 {item['symbol']} 数据时出错: {e}", e)
+                else:
+                    print(f"保存 {item['symbol']} 数据时出错: {e}")
+                data = None
+            result_q.put((item, data))
+    
+    def start(target, n):
+        threads = [threading.Thread(target=target, daemon=True) for _ in range(n)]
+        for t in threads:
+            t.start()
+        return threads
+    
+    def stop(q, threads):
+        for _ in threads:
+            q.put(None)
+        for t in threads:
+            t.join()
+    
+    for batch_start in range(0, len(items), batch_size):
+        fetch_q.put((batch_start, items[batch_start:batch_start + batch_size]))
+    fetchers = start(fetcher, fetch_workers)
+    normalizers = start(normalize_worker, normalize_workers)
+    writers = start(writer, write_workers)
+    try:
+        # 每支股票恰好产生一条结果
+        for _ in range(len(items)):
+            yield result_q.get()
     finally:
-        s.close()
+        # 正常结束时所有任务均已完成；提前关闭时丢弃尚未开始的批次，各阶段只等待进行中的任务结束
+        cancelled.set()
+        while True:
+            try:
+                fetch_q.get_nowait()
+            except queue.Empty:
+                break
+        # 依次关闭各阶段：上游线程全部退出后再向下游发送结束标记
+        stop(fetch_q, fetchers)
+        stop(norm_q, normalizers)
+        stop(write_q, writers)
 
 
 if __name__ == "__main__":
     # 初始化日志系统
     logger = get_logger(log_dir="log", log_level="INFO")
+    pool = None
     
     try:
-        load_dotenv(".env")
-        host = os.getenv("DOLPHINDB_HOST", "localhost")
-        port = int(os.getenv("DOLPHINDB_PORT", "8848"))
-        user = os.getenv("DOLPHINDB_USERNAME", "admin")
-        password = os.getenv("DOLPHINDB_PASSWORD", "123456")
+        cfg = Config.from_env(".env")
 
-        logger.info(f"连接到 DolphinDB 数据库 {host}:{port}")
+        logger.info(f"连接到 DolphinDB 数据库 {cfg.host}:{cfg.port}")
         try:
-            s = session()
-            # 尝试连接DolphinDB
-            s.connect(host, port, user, password)
-            logger.info("DolphinDB 连接成功")
-            s.close()
+            # 每个工作线程对应一个会话
+            pool = SessionPool(cfg.workers, cfg.host, cfg.port, cfg.user, cfg.password)
+            logger.info(f"DolphinDB 连接成功，会话池大小: {cfg.workers}")
         except Exception as e:
             logger.error(f"连接 DolphinDB 失败: {e}", e)
             raise
@@ -279,6 +771,8 @@ if __name__ == "__main__":
         # 使用新的去重函数，固定时间范围为2008-01-01到2025-08-01
         codes = get_unique_csi300_codes(file_path)
         logger.info(f"共获得 {len(codes)} 支去重后的CSI300股票")
+        # 输出目录只在启动时创建一次
+        os.makedirs("data", exist_ok=True)
         logger.info(f"数据时间范围: 2008-01-01 到 2025-08-01")
         
         # 显示前几个股票代码作为示例
@@ -289,28 +783,30 @@ if __name__ == "__main__":
             if len(codes) > 10:
                 logger.info(f"  ... 还有 {len(codes) - 10} 支股票")
         
-        # 为所有记录获取数据并保存
-        logger.info(f"开始获取并保存 {len(codes)} 支股票的数据...")
+        # 为所有记录获取数据并保存（按批次批量查询，多线程并发）
+        logger.info(f"开始获取并保存 {len(codes)} 支股票的数据，并发数: {cfg.workers}，每批 {cfg.batch_size} 支...")
         db_path = 'dfs://WIND_AShareEODPrices'
         db_table = 'AShareEODPrices'
+        # 原始查询结果缓存，重复运行时跳过已缓存股票的查询
+        cache = RawCache(".cache")
+        # 标准化处理器只创建一次（只读取一次交易日历），各线程共享；normalize 不修改实例状态
+        normalizer = _default_normalizer(logger)
         
         success_count = 0
         failed_count = 0
         
-        for i, item in enumerate(codes, 1):
-            logger.log_stock_start(item['symbol'], item['original_symbol'], i, len(codes))
-            
-            result = fetch_and_save_data(
-                host, port, user, password,
-                db_path, db_table,
-                item['symbol'],        # 重构后的 symbol (000001.SZ)
-                item['start_date'],    # 开始日期: 2008-01-01
-                item['end_date'],      # 结束日期: 2025-08-01
-                item['original_symbol'], # 原始 symbol (SZ000001)
-                normalize_data=True,   # 启用数据标准化
-                logger=logger         # 传入日志实例
-            )
-            
+        # 获取 / 标准化 / 写入 三阶段流水线，获取线程数与会话池大小一致
+        for item, result in run_pipeline(
+            pool,
+            db_path, db_table,
+            codes,
+            batch_size=cfg.batch_size, # 每条查询包含的股票数
+            fetch_workers=cfg.workers, # 获取线程数
+            normalize_data=True,       # 启用数据标准化
+            logger=logger,             # 传入日志实例
+            cache=cache,               # 原始数据缓存
+            normalizer=normalizer      # 共享的标准化处理器
+        ):
             if result is not None:
                 success_count += 1
                 logger.log_stock_success(item['symbol'], item['original_symbol'], len(result))
@@ -326,5 +822,8 @@ if __name__ == "__main__":
         logger.critical(f"程序执行过程中发生严重错误: {e}", e)
         raise
     finally:
+        # 出错时也关闭会话池中的所有会话
+        if pool is not None:
+            pool.close_all()
         # 关闭日志系统
         close_logger()
\ No newline at end of file
@@ -1,12 +1,48 @@
-import copy
 import datetime
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Iterable
+from typing import Dict, Iterable, Optional
 
 import numpy as np
 import pandas as pd
 
 
+def _ffill(values: np.ndarray) -> np.ndarray:
+    """
+    一维浮点数组的前向填充（等价于 Series.ffill / bottleneck.push，不经过 pandas）
+    
+    Parameters
+    ----------
+    values : np.ndarray
+        一维浮点数组
+        
+    Returns
+    -------
+    np.ndarray
+        填充后的新数组，开头的 NaN 保持不变
+    """
+    return values[_ffill_index(values)]
+
+
+def _ffill_index(values: np.ndarray) -> np.ndarray:
+    """
+    前向填充所用的下标：每个位置取最近一个非 NaN 元素的下标（开头的 NaN 取 0）
+    
+    Parameters
+    ----------
+    values : np.ndarray
+        一维浮点数组
+        
+    Returns
+    -------
+    np.ndarray
+        下标数组，values[下标] 即为前向填充结果
+    """
+    idx = np.where(np.isnan(values), 0, np.arange(len(values)))
+    np.maximum.accumulate(idx, out=idx)
+    return idx
+
+
 class WindNormalize1d:
     """
     Wind数        # 9. 处理无效成交量数据
@@ -39,9 +75,17 @@ class WindNormalize1d:
     
     # 标准化处理的价格字段
     COLUMNS = ["open", "close", "high", "low", "volume"]
+    # 复权时乘以复权因子的价格字段（成交量则除以复权因子）
+    PRICE_COLUMNS = [col for col in COLUMNS if col != "volume"]
+    # 异常涨跌幅修正时需要除以 100 的字段
+    ABNORMAL_FIX_COLUMNS = ["high", "close", "low", "open", "adjclose"]
+    # 字段映射后转为 FLOAT_DTYPE 的数值字段；输出本就以 float32 写入 qlib，
+    # 全程使用 float32 可使各步的内存占用和带宽减半
+    FLOAT_COLUMNS = ["open", "high", "low", "close", "volume", "amount", "adjclose"]
+    FLOAT_DTYPE = np.float32
     DATE_FORMAT = "%Y-%m-%d"
 
-    def __init__(self, calendar_file_path: str = None, date_field_name: str = "date", logger=None):
+    def __init__(self, calendar_file_path: str = None, date_field_name: str = "date", logger=None, debug: bool = False):
         """
         初始化Wind数据标准化处理器
         
@@ -53,9 +97,13 @@ class WindNormalize1d:
             日期字段名称，默认为 "date"
         logger : object
             日志记录器实例，可选
+        debug : bool
+            是否输出调试信息（各阶段的 NaN 统计、字段映射等），默认关闭；
+            这些统计每次都要扫描整个 DataFrame，批量处理时应保持关闭
         """
         self._date_field_name = date_field_name
         self._logger = logger
+        self._debug = debug
         
         # 如果没有提供日历文件路径，使用默认路径
         if calendar_file_path is None:
@@ -67,6 +115,18 @@ class WindNormalize1d:
             calendar_file_path = "calendar/day.txt"
             
         self._calendar_list = self._load_calendar(calendar_file_path)
+        
+        # 升序的交易日历索引（重新索引时按 searchsorted 切片），以及
+        # YYYYMMDD 整数键及对应日期（整数日期可直接查表转换）
+        if self._calendar_list is not None:
+            self._calendar_index = pd.DatetimeIndex(self._calendar_list).sort_values()
+            self._calendar_int = (self._calendar_index.year * 10000 + self._calendar_index.month * 100
+                                  + self._calendar_index.day).to_numpy(dtype=np.int64)
+            self._calendar_dt64 = self._calendar_index.to_numpy()
+        else:
+            self._calendar_index = None
+            self._calendar_int = None
+            self._calendar_dt64 = None
 
     def _load_calendar(self, calendar_file_path: str = "calendar/day.txt") -> list:
         """
@@ -99,7 +159,7 @@ class WindNormalize1d:
             msg = f"Loaded {len(calendar_list)} trading days from calendar"
             if self._logger:
                 self._logger.log_calendar_info(len(calendar_list), str(calendar_list[0].date()), str(calendar_list[-1].date()))
-            else:
+            elif self._debug:
                 print(f"Info: {msg}")
             return calendar_list
             
@@ -140,9 +200,35 @@ class WindNormalize1d:
         else:
             print("  No NaN values found")
 
+    def _parse_dates(self, dates: pd.Series) -> pd.Series:
+        """
+        把日期列转换为 datetime64
+        
+        已是 datetime64 的列原样返回；YYYYMMDD 整数且全部落在交易日历内时查表转换，
+        其余情况按 '%Y%m%d' 解析（无法解析的为 NaT）
+        
+        Parameters
+        ----------
+        dates : pd.Series
+            日期列
+            
+        Returns
+        -------
+        pd.Series
+            datetime64 日期列
+        """
+        if pd.api.types.is_datetime64_any_dtype(dates):
+            return dates
+        if self._calendar_int is not None and pd.api.types.is_integer_dtype(dates) and len(dates) and not dates.hasnans:
+            keys = dates.to_numpy(dtype=np.int64)
+            idx = np.searchsorted(self._calendar_int, keys).clip(max=len(self._calendar_int) - 1)
+            if (self._calendar_int[idx] == keys).all():
+                return pd.Series(self._calendar_dt64[idx], index=dates.index)
+        return pd.to_datetime(dates, format='%Y%m%d', errors='coerce')
+
     def map_wind_fields(self, df: pd.DataFrame) -> pd.DataFrame:
         """
-        将Wind字段名映射到标准字段名
+        将Wind字段名映射到标准字段名（原地修改 df）
         
         Parameters
         ----------
@@ -152,10 +238,8 @@ class WindNormalize1d:
         Returns
         -------
         pd.DataFrame
-            映射后的DataFrame
+            映射后的DataFrame（即传入的 df）
         """
-        df = df.copy()
-        
         # 检查并映射字段
         available_mappings = {}
         for wind_field, standard_field in self.WIND_FIELD_MAPPING.items():
@@ -165,15 +249,17 @@ class WindNormalize1d:
                 print(f"Warning: Wind field '{wind_field}' not found in data")
         
         # 执行字段重命名
-        df = df.rename(columns=available_mappings)
+        df.rename(columns=available_mappings, inplace=True)
         
         # 删除股票代码列（如果存在）
         if 'S_INFO_WINDCODE' in df.columns:
-            df = df.drop(columns=['S_INFO_WINDCODE'])
-            print("Info: Removed S_INFO_WINDCODE column")
+            df.drop(columns=['S_INFO_WINDCODE'], inplace=True)
+            if self._debug:
+                print("Info: Removed S_INFO_WINDCODE column")
         
         # 记录映射信息
-        print(f"Info: Mapped fields: {available_mappings}")
+        if self._debug:
+            print(f"Info: Mapped fields: {available_mappings}")
         
         return df
 
@@ -194,13 +280,49 @@ class WindNormalize1d:
         pd.Series
             涨跌幅序列
         """
-        df = df.copy()
-        _tmp_series = df["close"].ffill()
-        _tmp_shift_series = _tmp_series.shift(1)
-        if last_close is not None:
-            _tmp_shift_series.iloc[0] = float(last_close)
-        change_series = _tmp_series / _tmp_shift_series - 1
-        return change_series
+        return pd.Series(WindNormalize1d._calc_change_values(df["close"].to_numpy(dtype=WindNormalize1d.FLOAT_DTYPE), last_close), index=df.index)
+
+    @staticmethod
+    def _calc_change_values(close: np.ndarray, last_close: float = None) -> np.ndarray:
+        """
+        calc_change 的 ndarray 版本：收盘价前向填充后与前一日相比的涨跌幅
+        
+        Parameters
+        ----------
+        close : np.ndarray
+            收盘价数组
+        last_close : float
+            前一个交易日的收盘价，为 None 时第一天的涨跌幅为 NaN
+            
+        Returns
+        -------
+        np.ndarray
+            涨跌幅数组
+        """
+        return WindNormalize1d._change_from_filled(_ffill(close), last_close)
+
+    @staticmethod
+    def _change_from_filled(filled: np.ndarray, last_close: float = None) -> np.ndarray:
+        """
+        由已前向填充的收盘价计算涨跌幅
+        
+        Parameters
+        ----------
+        filled : np.ndarray
+            前向填充后的收盘价数组
+        last_close : float
+            前一个交易日的收盘价，为 None 时第一天的涨跌幅为 NaN
+            
+        Returns
+        -------
+        np.ndarray
+            涨跌幅数组
+        """
+        prev = np.empty_like(filled)
+        if len(filled):
+            prev[0] = np.nan if last_close is None else float(last_close)
+            prev[1:] = filled[:-1]
+        return filled / prev - 1
 
     def normalize_wind_data(self, df: pd.DataFrame, last_close: float = None) -> pd.DataFrame:
         """
@@ -221,73 +343,103 @@ class WindNormalize1d:
         if df.empty:
             return df
             
-        # 1. 映射字段名
-        df = self.map_wind_fields(df)
+        # 1. 映射字段名（只在入口复制一次，之后的步骤都在副本上原地修改）
+        df = self.map_wind_fields(df.copy())
         
         # 检查原始数据NaN情况
-        self._check_and_print_nan_stats(df, "字段映射后")
-        
-        # 2. 基础数据处理
-        columns = copy.deepcopy(self.COLUMNS)
-        df = df.copy()
+        if self._debug:
+            self._check_and_print_nan_stats(df, "字段映射后")
         
         # 3. 处理日期索引
-        df[self._date_field_name] = pd.to_datetime(df[self._date_field_name], format='%Y%m%d', errors='coerce')
+        df[self._date_field_name] = self._parse_dates(df[self._date_field_name])
         df.set_index(self._date_field_name, inplace=True)
-        
-        # 4. 去重
-        df = df[~df.index.duplicated(keep="first")]
+        # 数值字段转为 float32：设置索引后通常只剩这些字段，整表一次转换比逐列转换快一个数量级
+        if all(col in self.FLOAT_COLUMNS for col in df.columns):
+            df = df.astype(self.FLOAT_DTYPE)
+        else:
+            df = df.astype({col: self.FLOAT_DTYPE for col in self.FLOAT_COLUMNS if col in df.columns})
+        
+        # 4. 去重（保留第一条）：日期升序时重复日期必然相邻，只需与前一行比较，无需哈希
+        if df.index.is_monotonic_increasing:
+            dates = df.index.asi8
+            keep = np.empty(len(dates), dtype=bool)
+            keep[:1] = True
+            np.not_equal(dates[1:], dates[:-1], out=keep[1:])
+        else:
+            keep = ~df.index.duplicated(keep="first")
+        if not keep.all():
+            df = df[keep]
         
         # 5. 根据交易日历重新索引
-        if self._calendar_list is not None:
-            df = df.reindex(
-                pd.DataFrame(index=self._calendar_list)
-                .loc[
-                    pd.Timestamp(df.index.min()).date() : pd.Timestamp(df.index.max()).date()
-                    + pd.Timedelta(hours=23, minutes=59)
-                ]
-                .index
-            )
-            print('重新索引成功')
-        
-        # 6. 排序
-        df.sort_index(inplace=True)
+        if self._calendar_index is not None:
+            if df.index.isna().all():
+                # 日期全部无法解析（或没有数据）时没有可对齐的交易日，结果为空表
+                target = self._calendar_index[:0]
+            else:
+                # 取 [首日 00:00, 末日 23:59] 范围内的交易日
+                lo = self._calendar_index.searchsorted(pd.Timestamp(df.index.min()).normalize())
+                hi = self._calendar_index.searchsorted(
+                    pd.Timestamp(df.index.max()).normalize() + pd.Timedelta(hours=23, minutes=59), side="right"
+                )
+                target = self._calendar_index[lo:hi]
+            # 区间内交易日全部存在时（无停牌）索引已与日历一致，跳过 reindex 的整表复制
+            if len(df) != len(target) or not df.index.equals(target):
+                df = df.reindex(target)
+            if self._debug:
+                print('重新索引成功')
+        
+        # 6. 排序：按日历切片重新索引的结果本身就是升序的，只有没有日历时才需要排序
+        if self._calendar_index is None:
+            df.sort_index(inplace=True)
         
         # 7. 检查并打印NaN情况
-        self._check_and_print_nan_stats(df, "交易日历重新索引后")
+        if self._debug:
+            self._check_and_print_nan_stats(df, "交易日历重新索引后")
         
         # 8. 对close列进行前向填充
         if "close" in df.columns:
-            nan_count_before = df["close"].isna().sum()
-            df["close"] = df["close"].ffill()
-            nan_count_after = df["close"].isna().sum()
-            print(f"Info: Close column forward fill - NaN before: {nan_count_before}, after: {nan_count_after}")
-        
-        # 9. 处理无效成交量数据
-        df.loc[(df["volume"] <= 0) | np.isnan(df["volume"]), df.columns] = np.nan
+            close = df["close"].to_numpy(dtype=self.FLOAT_DTYPE)
+            filled_close = _ffill(close)
+            df["close"] = filled_close
+            if self._debug:
+                print(f"Info: Close column forward fill - NaN before: {np.isnan(close).sum()}, after: {np.isnan(filled_close).sum()}")
+        
+        # 9. 处理无效成交量数据（掩码只计算一次，第 10 步复用）
+        volume = df["volume"].to_numpy(dtype=self.FLOAT_DTYPE)
+        invalid_volume = (volume <= 0) | np.isnan(volume)
+        df.loc[invalid_volume] = np.nan
 
         # 8. 检测并修正异常数据 (参考Yahoo处理逻辑)
-        _count = 0
-        while True:
-            change_series = self.calc_change(df, last_close)
-            _mask = (change_series >= 89) & (change_series <= 111)
-            if not _mask.any():
-                break
-            _tmp_cols = ["high", "close", "low", "open", "adjclose"]
-            available_cols = [col for col in _tmp_cols if col in df.columns]
-            df.loc[_mask, available_cols] = df.loc[_mask, available_cols] / 100
-            _count += 1
-            if _count >= 10:
-                print(f"Warning: Stock `change` is abnormal for {_count} consecutive days, please check the data carefully")
-                break
+        # 先只用 close 列检测，没有异常时（绝大多数股票）直接沿用这次算出的 change，
+        # 不再取出整块价格列；有异常时才在 ndarray 副本上修正并整体写回 df
+        close = df["close"].to_numpy(dtype=self.FLOAT_DTYPE)
+        fill_idx = _ffill_index(close)
+        filled = close[fill_idx]
+        change_values = self._change_from_filled(filled, last_close)
+        _mask = (change_values >= 89) & (change_values <= 111)
+        if _mask.any():
+            available_cols = [col for col in self.ABNORMAL_FIX_COLUMNS if col in df.columns]
+            prices = df[available_cols].to_numpy(dtype=self.FLOAT_DTYPE)
+            _count = 0
+            while True:
+                prices[_mask] /= 100
+                # 修正只改变数值不改变 NaN 分布：被修正的行以及由它们前向填充的行同步除以 100 即可，无需重新填充
+                filled[_mask[fill_idx]] /= 100
+                _count += 1
+                if _count >= 10:
+                    print(f"Warning: Stock `change` is abnormal for {_count} consecutive days, please check the data carefully")
+                    change_values = self._change_from_filled(filled, last_close)
+                    break
+                change_values = self._change_from_filled(filled, last_close)
+                _mask = (change_values >= 89) & (change_values <= 111)
+                if not _mask.any():
+                    break
+            df[available_cols] = prices
 
         # 9. 计算涨跌幅
-        df["change"] = self.calc_change(df, last_close)
-
-        # 10. 处理无效数据
-        columns += ["change"]
-        available_columns = [col for col in columns if col in df.columns]
-        df.loc[(df["volume"] <= 0) | np.isnan(df["volume"]), available_columns] = np.nan
+        # 10. 处理无效数据：第 9 步已把无效成交量的整行置为 NaN，修正循环不会改动这些行，
+        # 这里只需把 change 在同样的行上置为 NaN
+        df["change"] = np.where(invalid_volume, np.nan, change_values)
 
         # 11. 设置索引名称
         df.index.names = [self._date_field_name]
@@ -311,24 +463,22 @@ class WindNormalize1d:
         if df.empty:
             return df
             
-        df = df.copy()
-        df.set_index(self._date_field_name, inplace=True)
+        df = df.set_index(self._date_field_name)
         
         # 计算复权因子
         if "adjclose" in df.columns:
-            df["factor"] = df["adjclose"] / df["close"]
-            df["factor"] = df["factor"].ffill()
+            factor = _ffill(df["adjclose"].to_numpy(dtype=self.FLOAT_DTYPE) / df["close"].to_numpy(dtype=self.FLOAT_DTYPE))
+            df["factor"] = factor
         else:
-            df["factor"] = 1
+            factor = np.ones(len(df), dtype=self.FLOAT_DTYPE)
+            df["factor"] = factor
             
-        # 对价格字段进行复权
-        for _col in self.COLUMNS:
-            if _col not in df.columns:
-                continue
-            if _col == "volume":
-                df[_col] = df[_col] / df["factor"]
-            else:
-                df[_col] = df[_col] * df["factor"]
+        # 对价格字段进行复权：价格列整体乘以复权因子，成交量除以复权因子
+        price_cols = [col for col in self.PRICE_COLUMNS if col in df.columns]
+        if price_cols:
+            df[price_cols] = df[price_cols].to_numpy(dtype=self.FLOAT_DTYPE) * factor[:, None]
+        if "volume" in df.columns:
+            df["volume"] = df["volume"].to_numpy(dtype=self.FLOAT_DTYPE) / factor
                 
         df.index.names = [self._date_field_name]
         return df.reset_index()
@@ -347,9 +497,11 @@ class WindNormalize1d:
         float
             第一个有效收盘价
         """
-        df = df.loc[df["close"].first_valid_index() :]
-        _close = df["close"].iloc[0]
-        return _close
+        close = df["close"].to_numpy(dtype=self.FLOAT_DTYPE)
+        valid = ~np.isnan(close)
+        if not valid.any():
+            return np.nan
+        return float(close[valid.argmax()])
 
     def _manual_adj_data(self, df: pd.DataFrame) -> pd.DataFrame:
         """
@@ -368,20 +520,19 @@ class WindNormalize1d:
         if df.empty:
             return df
             
-        df = df.copy()
-        df.sort_values(self._date_field_name, inplace=True)
-        df = df.set_index(self._date_field_name)
+        df = df.sort_values(self._date_field_name).set_index(self._date_field_name)
         _close = self._get_first_close(df)
         
+        # 跳过非数值列和特殊字段；volume 乘以、其余数值列除以第一天的收盘价，
+        # 在 ndarray 上计算后用一次 assign 写回，避免逐列 __setitem__
+        adjusted = {}
         for _col in df.columns:
-            # 跳过非数值列和特殊字段
             if _col in ["adjclose", "change", self._date_field_name] or not pd.api.types.is_numeric_dtype(df[_col]):
                 continue
-            if _col == "volume":
-                df[_col] = df[_col] * _close
-            else:
-                df[_col] = df[_col] / _close
-                
+            values = df[_col].to_numpy()
+            adjusted[_col] = values * _close if _col == "volume" else values / _close
+        df = df.assign(**adjusted)
+
         return df.reset_index()
 
     def normalize(self, df: pd.DataFrame, last_close: float = None) -> pd.DataFrame:
@@ -411,6 +562,101 @@ class WindNormalize1d:
         
         return df
 
+    def normalize_panel(
+        self,
+        df_long: pd.DataFrame,
+        last_closes: Optional[Dict[str, float]] = None,
+        symbol_field_name: str = "S_INFO_WINDCODE",
+    ) -> pd.DataFrame:
+        """
+        标准化包含多只股票的长表（例如一条 IN 查询的结果），按股票分组逐只调用 normalize
+        
+        Parameters
+        ----------
+        df_long : pd.DataFrame
+            多只股票的原始Wind数据
+        last_closes : Dict[str, float]
+            股票代码 -> 前一个交易日的收盘价，可选
+        symbol_field_name : str
+            股票代码字段名称，默认为 "S_INFO_WINDCODE"
+            
+        Returns
+        -------
+        pd.DataFrame
+            标准化后的长表，第一列为股票代码，股票顺序与首次出现的顺序相同
+        """
+        if df_long.empty:
+            return df_long
+        last_closes = last_closes or {}
+        
+        # 一次分组得到各股票的行号，再按行号取子表，不必对每只股票做一遍布尔筛选；
+        # 股票代码列先去掉（map_wind_fields 只会删除 S_INFO_WINDCODE），结果中再统一插入到第一列
+        values = df_long.drop(columns=[symbol_field_name])
+        frames = []
+        for symbol, rows in df_long.groupby(symbol_field_name, sort=False, observed=True).indices.items():
+            normalized = self.normalize(values.take(rows), last_closes.get(symbol))
+            normalized.insert(0, symbol_field_name, symbol)
+            frames.append(normalized)
+        return pd.concat(frames, ignore_index=True)
+
+
+# 子进程内的标准化处理器，由 _init_worker 在每个进程中创建一次
+_worker_normalizer = None
+
+
+def _init_worker(calendar_file_path: str, date_field_name: str):
+    """ProcessPoolExecutor 的 initializer：每个子进程只加载一次交易日历"""
+    global _worker_normalizer
+    _worker_normalizer = WindNormalize1d(calendar_file_path=calendar_file_path, date_field_name=date_field_name)
+
+
+def _normalize_in_worker(args):
+    df, last_close = args
+    return _worker_normalizer.normalize(df, last_close)
+
+
+def normalize_many(
+    frames_by_symbol: Dict[str, pd.DataFrame],
+    calendar_file_path: str = None,
+    last_closes: Optional[Dict[str, float]] = None,
+    n_jobs: Optional[int] = None,
+    date_field_name: str = "date",
+) -> Dict[str, pd.DataFrame]:
+    """
+    多进程并行标准化多只股票的数据
+    
+    各股票的标准化互不依赖，计算主要在 pandas/NumPy 中进行且会持有 GIL，
+    因此按进程而不是线程并行；每个子进程只创建一次 WindNormalize1d（只加载一次交易日历）。
+    
+    Parameters
+    ----------
+    frames_by_symbol : Dict[str, pd.DataFrame]
+        股票代码 -> 原始Wind数据
+    calendar_file_path : str
+        交易日历文件路径
+    last_closes : Dict[str, float]
+        股票代码 -> 前一个交易日的收盘价，可选
+    n_jobs : int
+        进程数，None 或 -1 表示使用全部 CPU
+    date_field_name : str
+        日期字段名称，默认为 "date"
+        
+    Returns
+    -------
+    Dict[str, pd.DataFrame]
+        股票代码 -> 标准化后的数据，顺序与 frames_by_symbol 相同
+    """
+    last_closes = last_closes or {}
+    symbols = list(frames_by_symbol)
+    max_workers = None if n_jobs in (None, -1) else n_jobs
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=_init_worker, initargs=(calendar_file_path, date_field_name)
+    ) as executor:
+        results = executor.map(
+            _normalize_in_worker, ((frames_by_symbol[symbol], last_closes.get(symbol)) for symbol in symbols)
+        )
+        return dict(zip(symbols, results))
+
 
 def process_wind_data(input_file: str, output_file: str, calendar_file: str = None):
     """
@@ -437,4 +683,15 @@ def process_wind_data(input_file: str, output_file: str, calendar_file: str = No
 
 
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+    # 测试多只股票长表的分组标准化（使用非默认的股票代码字段名）
+    dates = pd.bdate_range("2024-01-01", periods=5)
+    panel = pd.DataFrame({
+        "symbol": ["000001.SZ"] * 5 + ["600000.SH"] * 5,
+        "TRADE_DT": list(dates) * 2,
+        "S_DQ_OPEN": 10.0, "S_DQ_HIGH": 10.5, "S_DQ_LOW": 9.5, "S_DQ_CLOSE": 10.0,
+        "S_DQ_VOLUME": 1000.0, "S_DQ_AMOUNT": 10000.0, "S_DQ_ADJCLOSE": 12.0,
+    })
+    result = WindNormalize1d().normalize_panel(panel, symbol_field_name="symbol")
+    assert list(result.columns[:2]) == ["symbol", "date"]
+    assert result["symbol"].unique().tolist() == ["000001.SZ", "600000.SH"]
+    print(result)